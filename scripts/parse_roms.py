@@ -1,21 +1,42 @@
 #!/usr/bin/env python3
 import PIL
 import argparse
+import ast
+import atexit
+import ctypes
 import hashlib
+import importlib.util
+import io
+import json
+import mmap
+import multiprocessing
 import os
+import platform
+import re
 import shutil
 import struct
 import subprocess
 import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import redirect_stdout
+from dataclasses import dataclass, replace
+from functools import cached_property, lru_cache, partial
 from pathlib import Path
-from tempfile import TemporaryDirectory
-from typing import List
+from tempfile import NamedTemporaryFile, TemporaryDirectory
+from typing import Callable, List
 
 try:
     from tqdm import tqdm
 except ImportError:
     tqdm = None
 
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
 ROM_ENTRIES_TEMPLATE = """
 const retro_emulator_file_t {name}[] EMU_DATA = {{
 {body}
@@ -51,6 +72,9 @@ ROM_ENTRY_TEMPLATE = """\t{{
 #endif
 \t}},"""
 
+# Filename tags of roms that run at PAL speed
+PAL_REGION_RE = re.compile(r"\((?:E|Europe|Sweden|Germany|Italy|France|A|Australia)\)")
+
 SYSTEM_PROTO_TEMPLATE = """
 #if !defined (COVERFLOW)
   #define COVERFLOW 0
@@ -95,6 +119,13 @@ SAVE_SIZES = {
 }
 
 
+# Bank count and bank sizes in the header of SMS/GG/MD compressed roms
+BANK_HEADER = struct.Struct("<l")
+
+# Banks the GB bank cache holds, the budget of --compress_gb_speed
+# TODO : can we get the value from the linker ?
+GB_CACHE_SLOTS = 26
+
 # TODO: Find a better way to find this before building
 MAX_COMPRESSED_NES_SIZE = 0x00080010 #512kB + 16 bytes header
 MAX_COMPRESSED_PCE_SIZE = 0x00049000
@@ -108,7 +139,10 @@ All ``compress_*`` functions must be decorated ``@COMPRESSIONS`` and have the
 following signature:
 
 Positional argument:
-    data : bytes
+    data : bytes-like object
+
+Each call must return a self-contained stream, as banks are decompressed
+independently on the device: no compressor state is carried between calls.
 
 Optional argument:
     level : ``None`` for default value,  depends on compression algorithm.
@@ -121,6 +155,13 @@ And return compressed bytes.
 
 DONT_COMPRESS = object()
 
+LZMA_MIN_DICT_SIZE = 4 * 1024  # liblzma minimum
+LZMA_MAX_DICT_SIZE = 16 * 1024
+
+# is_incompressible() samples up to PROBE_CHUNKS slices of PROBE_CHUNK_SIZE
+PROBE_CHUNKS = 16
+PROBE_CHUNK_SIZE = 4 * 1024
+
 
 class CompressionRegistry(dict):
     prefix = "compress_"
@@ -146,14 +187,21 @@ def compress_lzma(data, level=None):
         return data
     import lzma
 
+    # The header carrying the dictionary size is stripped below, so the
+    # decoder always assumes LZMA_MAX_DICT_SIZE: a dictionary may only shrink.
+    # Never going below the input size keeps the ratio, while small inputs
+    # skip setting up match finder tables they can't use.
+    dict_size = 1 << max(0, len(data) - 1).bit_length()
+    dict_size = max(LZMA_MIN_DICT_SIZE, min(LZMA_MAX_DICT_SIZE, dict_size))
+
     compressed_data = lzma.compress(
         data,
         format=lzma.FORMAT_ALONE,
         filters=[
             {
                 "id": lzma.FILTER_LZMA1,
-                "preset": 6,
-                "dict_size": 16 * 1024,
+                "preset": 6 if level is None else level,
+                "dict_size": dict_size,
             }
         ],
     )
@@ -162,46 +210,205 @@ def compress_lzma(data, level=None):
 
     return compressed_data
 
-def sha1_for_file(filename):
-    sha1 = hashlib.sha1()
-    if os.path.exists(filename):
-        with open(filename, 'rb') as f:
-            while True:
-                data = f.read(16*1024)
-                if not data:
-                    break
-                sha1.update(data)
+SHA1_CACHE_FILE = Path("build/.sha1cache.json")
+SAVE_SIZE_CACHE_FILE = Path("build/.savesizecache.json")
+# Roms is_incompressible() rejected, they never get a compressed file
+INCOMPRESSIBLE_CACHE_FILE = Path("build/.incompressiblecache.json")
+
+
+@lru_cache(maxsize=None)
+def _load_file_cache(cache_file):
+    """Load a {path: [mtime_ns, size, value]} cache, saved again on exit."""
+    try:
+        cache = json.loads(cache_file.read_text())
+    except (FileNotFoundError, ValueError):
+        cache = {}
+    atexit.register(_save_file_cache, cache_file, cache)
+    return cache
+
+
+def _save_file_cache(cache_file, cache):
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    cache_file.write_text(json.dumps(cache, indent=1, sort_keys=True))
+
+
+def _file_stamp(filename):
+    # Size is part of it as well, mtime alone can miss quick rewrites
+    st = os.stat(filename)
+    return [st.st_mtime_ns, st.st_size]
 
+
+def lookup_for_file(cache_file, filename, depends=()):
+    """The value kept for filename in cache_file, None if the file or one of
+    the files in depends, like the script computing it, changed."""
+    entry = _load_file_cache(cache_file).get(os.path.abspath(filename))
+    if (
+        entry
+        and entry[:2] == _file_stamp(filename)
+        and entry[3:] == [_file_stamp(d) for d in depends]
+    ):
+        return entry[2]
+    return None
+
+
+def store_for_file(cache_file, filename, value, depends=()):
+    _load_file_cache(cache_file)[os.path.abspath(filename)] = [
+        *_file_stamp(filename), value, *(_file_stamp(d) for d in depends)
+    ]
+
+
+def cached_for_file(cache_file, filename, compute, depends=()):
+    """``compute(filename)``, kept in cache_file until the file or one of the
+    files in depends changes."""
+    value = lookup_for_file(cache_file, filename, depends)
+    if value is None:
+        value = compute(filename)
+        store_for_file(cache_file, filename, value, depends)
+    return value
+
+
+def load_json(path):
+    """Content of a json file, an invalid one is reported and stops the build."""
+    try:
+        return json_loads(Path(path).read_bytes())
+    except ValueError as e:
+        print(f"Error: {path} is not valid JSON: {e}")
+        exit(-1)
+
+
+def _forget_sha1(filename):
+    # mtime may not change on coarse timestamp filesystems, drop patched files explicitly
+    _load_file_cache(SHA1_CACHE_FILE).pop(os.path.abspath(filename), None)
+
+
+def _sha1_digest(filename):
+    with open(filename, 'rb') as f:
+        if hasattr(hashlib, "file_digest"):  # Python 3.11+
+            return hashlib.file_digest(f, "sha1").hexdigest()
+        sha1 = hashlib.sha1()
+        # mmap can't map empty files, they hash to the empty digest
+        if os.fstat(f.fileno()).st_size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                sha1.update(mm)
         return sha1.hexdigest()
+
+
+COMPRESS_CACHE_DIR = Path("build/compress_cache")
+# Part of every cache key, bump it when a compress_* function changes output
+COMPRESS_CACHE_VERSION = 1
+# Entries not used for this long are removed by prune_compress_cache()
+COMPRESS_CACHE_MAX_AGE = 30 * 24 * 3600
+
+
+@lru_cache(maxsize=None)
+def _lzma_version():
+    """Version of the liblzma behind the lzma module. Python's version when
+    liblzma is built into it and doesn't export its symbols."""
+    import _lzma
+
+    try:
+        version_string = ctypes.CDLL(_lzma.__file__).lzma_version_string
+    except (OSError, AttributeError):
+        return "python-" + platform.python_version()
+    version_string.restype = ctypes.c_char_p
+    return version_string().decode()
+
+
+def cached_compress(data, level=None, compress=None):
+    """``compress(data, level)`` through an on-disk cache keyed by content, so
+    roms whose compressed files were deleted don't need compressing again."""
+    if level == DONT_COMPRESS:
+        return compress(data, level=level)
+
+    # Another liblzma may compress the same data differently
+    lib_version = _lzma_version() if compress is compress_lzma else ""
+    tag = f"{compress.__name__}:{level}:{COMPRESS_CACHE_VERSION}:{lib_version}"
+    key = hashlib.blake2b(data, digest_size=16, key=tag.encode()).hexdigest()
+    cache_file = COMPRESS_CACHE_DIR / key
+    try:
+        compressed_data = cache_file.read_bytes()
+    except FileNotFoundError:
+        pass
     else:
-        return ""
+        # Marks the entry as used for prune_compress_cache()
+        os.utime(cache_file)
+        return compressed_data
+
+    compressed_data = compress(data, level=level)
+    # Written aside then renamed, other workers must never see partial data.
+    # The name is unique to this write, threads may compress the same data.
+    COMPRESS_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    with NamedTemporaryFile(
+        dir=COMPRESS_CACHE_DIR, prefix=f"{key}.", suffix=".tmp", delete=False
+    ) as tmp_file:
+        tmp_file.write(compressed_data)
+    os.replace(tmp_file.name, cache_file)
+    return compressed_data
 
 
-def parse_msx_bios_files():
-    #check that required MSX bios files are present
-    if (sha1_for_file("roms/msx_bios/MSX2P.rom") != "e90f80a61d94c617850c415e12ad70ac41e66bb7"):
-        print("Bad or missing roms/msx_bios/MSX2P.rom, check roms/msx_bios/README.md for info")
-        return 0
+def prune_compress_cache():
+    """Remove the compress cache entries unused for COMPRESS_CACHE_MAX_AGE,
+    like those of roms that were removed or settings no longer used."""
+    oldest = time.time() - COMPRESS_CACHE_MAX_AGE
+    try:
+        entries = os.scandir(COMPRESS_CACHE_DIR)
+    except FileNotFoundError:
+        return
+    with entries:
+        for entry in entries:
+            try:
+                if entry.stat().st_mtime < oldest:
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                pass  # removed meanwhile
 
-    if (sha1_for_file("roms/msx_bios/MSX2PEXT.rom") != "fe0254cbfc11405b79e7c86c7769bd6322b04995"):
-        print("Bad or missing roms/msx_bios/MSX2PEXT.rom, check roms/msx_bios/README.md for info")
-        return 0
 
-    if (sha1_for_file("roms/msx_bios/MSX2PMUS.rom") != "6354ccc5c100b1c558c9395fa8c00784d2e9b0a3"):
-        print("Bad or missing roms/msx_bios/MSX2PMUS.rom, check roms/msx_bios/README.md for info")
-        return 0
+def is_incompressible(data):
+    """Quick estimate from a fast LZMA pass over slices spread across the
+    data, so a full compression isn't spent on data that won't shrink."""
+    import lzma
 
-    if (sha1_for_file("roms/msx_bios/MSX2.rom") != "6103b39f1e38d1aa2d84b1c3219c44f1abb5436e"):
-        print("Bad or missing roms/msx_bios/MSX2.rom, check roms/msx_bios/README.md for info")
-        return 0
+    step = max(PROBE_CHUNK_SIZE, len(data) // PROBE_CHUNKS)
+    sample = b"".join(
+        data[i : i + PROBE_CHUNK_SIZE] for i in range(0, len(data), step)
+    )
+    if not sample:
+        return False
+    estimate = lzma.compress(
+        sample,
+        format=lzma.FORMAT_RAW,
+        filters=[{"id": lzma.FILTER_LZMA1, "preset": 1}],
+    )
+    return len(estimate) >= 0.98 * len(sample)
 
-    if (sha1_for_file("roms/msx_bios/MSX2EXT.rom") != "5c1f9c7fb655e43d38e5dd1fcc6b942b2ff68b02"):
-        print("Bad or missing roms/msx_bios/MSX2EXT.rom, check roms/msx_bios/README.md for info")
-        return 0
 
-    if (sha1_for_file("roms/msx_bios/MSX.rom") != "e998f0c441f4f1800ef44e42cd1659150206cf79"):
-        print("Bad or missing roms/msx_bios/MSX.rom, check roms/msx_bios/README.md for info")
-        return 0
+def sha1_for_file(filename):
+    try:
+        return cached_for_file(SHA1_CACHE_FILE, filename, _sha1_digest)
+    except FileNotFoundError:
+        return ""
+
+
+MSX_BIOS_FILES = [
+    ("roms/msx_bios/MSX2P.rom", "e90f80a61d94c617850c415e12ad70ac41e66bb7"),
+    ("roms/msx_bios/MSX2PEXT.rom", "fe0254cbfc11405b79e7c86c7769bd6322b04995"),
+    ("roms/msx_bios/MSX2PMUS.rom", "6354ccc5c100b1c558c9395fa8c00784d2e9b0a3"),
+    ("roms/msx_bios/MSX2.rom", "6103b39f1e38d1aa2d84b1c3219c44f1abb5436e"),
+    ("roms/msx_bios/MSX2EXT.rom", "5c1f9c7fb655e43d38e5dd1fcc6b942b2ff68b02"),
+    ("roms/msx_bios/MSX.rom", "e998f0c441f4f1800ef44e42cd1659150206cf79"),
+]
+
+
+def parse_msx_bios_files():
+    #check that required MSX bios files are present
+    _load_file_cache(SHA1_CACHE_FILE)  # load once before the threads share it
+    with ThreadPoolExecutor() as executor:
+        digests = list(executor.map(sha1_for_file, [path for path, _ in MSX_BIOS_FILES]))
+
+    for (path, expected), digest in zip(MSX_BIOS_FILES, digests):
+        if digest != expected:
+            print(f"Bad or missing {path}, check roms/msx_bios/README.md for info")
+            return 0
 
     # We revert previously patched PANASONICDISK if needed as we changed how it is done
     if (sha1_for_file("roms/msx_bios/PANASONICDISK.rom") == "b9bce28fb74223ea902f82ebd107279624cf2aba"):
@@ -209,6 +416,7 @@ def parse_msx_bios_files():
         with open("roms/msx_bios/PANASONICDISK.rom", 'rb+') as f:
             f.seek(0x17ec)
             f.write(b'\x02')
+        _forget_sha1("roms/msx_bios/PANASONICDISK.rom")
 
     if (sha1_for_file("roms/msx_bios/PANASONICDISK.rom") != "7ed7c55e0359737ac5e68d38cb6903f9e5d7c2b6"):
         print("Bad or missing roms/msx_bios/PANASONICDISK.rom, check roms/msx_bios/README.md for info")
@@ -221,11 +429,13 @@ def parse_msx_bios_files():
     # like Fray, XAK III, 
     if (sha1_for_file("roms/msx_bios/PANASONICDISK_.rom") != "b9bce28fb74223ea902f82ebd107279624cf2aba"):
         shutil.copy("roms/msx_bios/PANASONICDISK.rom","roms/msx_bios/PANASONICDISK_.rom")
+        _forget_sha1("roms/msx_bios/PANASONICDISK_.rom")
         if (sha1_for_file("roms/msx_bios/PANASONICDISK_.rom") == "7ed7c55e0359737ac5e68d38cb6903f9e5d7c2b6"):
             print("Patching roms/msx_bios/PANASONICDISK_.rom to disable 2nd FDD controller (= more free RAM)")
             with open("roms/msx_bios/PANASONICDISK_.rom", 'rb+') as f:
                 f.seek(0x17ec)
                 f.write(b'\x00')
+            _forget_sha1("roms/msx_bios/PANASONICDISK_.rom")
         else:
             print("Bad or missing roms/msx_bios/PANASONICDISK.rom, check roms/msx_bios/README.md for info")
             return 0
@@ -235,8 +445,21 @@ def parse_msx_bios_files():
 
 def write_covart(srcfile, fn, w, h, jpg_quality):
     from PIL import Image, ImageOps
-    img = Image.open(srcfile).convert(mode="RGB").resize((w, h), Image.LANCZOS)
-    img.save(fn,format="JPEG",optimize=True,quality=jpg_quality)
+    img = Image.open(srcfile)
+    # JPEG sources can be decoded at 1/2, 1/4 or 1/8 scale by libjpeg, keep
+    # at least twice the cover size so LANCZOS still has detail to filter
+    img.draft("RGB", (w * 2, h * 2))
+    img = img.convert(mode="RGB").resize((w, h), Image.LANCZOS)
+    # Every byte saved here is saved for every cover in external flash.
+    # 4:2:0 chroma subsampling is invisible at cover sizes, but the covers
+    # must stay baseline: the device's JPEG decoder can't do progressive.
+    img.save(fn,format="JPEG",optimize=True,quality=jpg_quality,subsampling=2)
+
+def suggest_pillow_simd():
+    # Pillow-SIMD is a drop-in replacement with AVX2 resize kernels, its
+    # versions carry a ".postN" suffix
+    if platform.machine() in ("x86_64", "AMD64") and "post" not in PIL.__version__:
+        print("HINT: pip install pillow-simd for faster cover art resizing")
 
 # def write_rgb565(srcfile, fn, v):
 #     from PIL import Image, ImageOps
@@ -252,6 +475,351 @@ def write_covart(srcfile, fn, w, h, jpg_quality):
 #             b = (pix[2] >> 3) & 0x1F
 #             f.write(struct.pack("H", (r << 11) + (g << 5) + b))
 
+def _is_importable_script(source, functions):
+    """Whether importing a script only defines things: its top level holds
+    imports, definitions, assignments without calls and the __main__ guard,
+    and it defines all the given functions."""
+    try:
+        tree = ast.parse(source)
+    except SyntaxError:
+        return False
+
+    defined = set()
+    has_main_guard = False
+    for node in tree.body:
+        if isinstance(node, (ast.Import, ast.ImportFrom, ast.ClassDef)):
+            continue
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            defined.add(node.name)
+        elif isinstance(node, ast.Expr) and isinstance(node.value, ast.Constant):
+            continue  # docstring
+        elif isinstance(node, (ast.Assign, ast.AnnAssign)):
+            if any(isinstance(n, ast.Call) for n in ast.walk(node)):
+                return False
+        elif (
+            isinstance(node, ast.If)
+            and isinstance(node.test, ast.Compare)
+            and isinstance(node.test.left, ast.Name)
+            and node.test.left.id == "__name__"
+            and any(
+                isinstance(c, ast.Constant) and c.value == "__main__"
+                for c in node.test.comparators
+            )
+        ):
+            has_main_guard = True
+        else:
+            return False
+    return has_main_guard and defined.issuperset(functions)
+
+
+@lru_cache(maxsize=None)
+def _import_script(path, *functions):
+    """The helper script at path as a module if it provides all the given
+    functions, None if it can only be run as a script.
+
+    The source is checked first, so a script whose command line code would
+    run on import is never executed here."""
+    try:
+        if not _is_importable_script(Path(path).read_bytes(), functions):
+            return None
+        spec = importlib.util.spec_from_file_location(Path(path).stem, path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    except (Exception, SystemExit):
+        return None
+    if all(callable(getattr(module, f, None)) for f in functions):
+        return module
+    return None
+
+
+NESMAPPER_SCRIPT = "fceumm-go/nesmapper.py"
+# nesmapper adds the mappers it finds to build/mappers.h, one call at a time
+_NESMAPPER_LOCK = threading.Lock()
+
+
+def run_nesmapper(command, path):
+    # In-process when possible, saving an interpreter start per rom
+    with _NESMAPPER_LOCK:
+        nesmapper = _import_script(NESMAPPER_SCRIPT, "mapper", "savesize")
+        if nesmapper is not None:
+            return int(getattr(nesmapper, command)(str(path)))
+        return int(subprocess.check_output([sys.executable, NESMAPPER_SCRIPT, command, path]))
+
+
+def run_dsk_converter(script, path, compress):
+    # In-process when the script provides convert(path, compress), saving
+    # an interpreter start per disk
+    converter = _import_script(script, "convert")
+    if converter is not None:
+        converter.convert(str(path), compress)
+    else:
+        subprocess.check_output([sys.executable, script, str(path), compress])
+
+
+def _init_compress_worker(parsed_args):
+    # Workers started with "spawn" don't inherit the globals set under __main__
+    global args
+    args = parsed_args
+
+
+def _compress_one(variable_name, rom, **kwargs):
+    # Run in a worker process. What it prints is returned, to be shown with
+    # the rest of its system's output.
+    with redirect_stdout(io.StringIO()) as printed:
+        incompressible = ROMParser._compress_rom(variable_name, rom, **kwargs)
+    return incompressible, printed.getvalue()
+
+
+class _ThreadOutput:
+    """sys.stdout while systems are prepared concurrently: what a thread
+    prints under capture() is kept apart, other prints go through."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._local = threading.local()
+
+    def write(self, text):
+        return getattr(self._local, "buffer", self.stream).write(text)
+
+    def flush(self):
+        getattr(self._local, "buffer", self.stream).flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+    def capture(self, func, *args):
+        """func(*args) and the text it printed."""
+        self._local.buffer = io.StringIO()
+        try:
+            return func(*args), self._local.buffer.getvalue()
+        except BaseException:
+            # Still show what led to the error
+            self.stream.write(self._local.buffer.getvalue())
+            raise
+        finally:
+            del self._local.buffer
+
+
+class _SymbolCharMap(dict):
+    """str.translate() table mapping every non alphanumeric character to "_",
+    filled in as new characters are seen."""
+
+    def __missing__(self, char):
+        self[char] = char if chr(char).isalnum() else ord("_")
+        return self[char]
+
+
+_SYMBOL_CHAR_MAP = _SymbolCharMap()
+
+
+def symbol_safe(name: str) -> str:
+    return name.translate(_SYMBOL_CHAR_MAP)
+
+
+_WHITESPACE_RE = re.compile(r"\s+")
+# A hex byte of a PCE patch command, emitted as a "\xNN" C string escape
+_HEX_BYTE_RE = re.compile(r"[0-9A-Fa-f]{2}")
+
+
+def _cheat_desc(desc):
+    """Shorten a cheat description and escape it for a C string."""
+    if desc is None:
+        return None
+    desc = desc[:40]
+    desc = desc.replace('\\', r'\\\\')
+    desc = desc.replace('"', r'\"')
+    return desc.strip()
+
+
+@dataclass
+class SystemSpec:
+    """How parse() generates one system, see ROMParser.generate_system()."""
+
+    file: str
+    system_name: str
+    variable_name: str
+    folder: str
+    extensions: List[str]
+    save_prefix: str
+    cheat_codes_prefix: str = None
+    # Added to build/config.h when the system has roms
+    define: str = None
+    # Whether --compress and --compress_gb_speed apply
+    compress: bool = False
+    compress_gb_speed: bool = False
+    # Whether its roms count for the SMS/GG/MD rom cache
+    rom_cache: bool = False
+    # Bios systems: folder of the system they are for. Without roms there,
+    # only an empty .c file is generated. Otherwise check() must pass first.
+    bios_for: str = None
+    check: Callable[[], bool] = None
+
+
+# In rom id order
+SYSTEMS = [
+    SystemSpec(
+        "Core/Src/retro-go/gb_roms.c",
+        "Nintendo Gameboy",
+        "gb_system",
+        "gb",
+        ["gb", "gbc"],
+        "SAVE_GB_",
+        define="ENABLE_EMULATOR_GB",
+        compress=True,
+        compress_gb_speed=True,
+    ),
+    SystemSpec(
+        "Core/Src/retro-go/nes_roms.c",
+        "Nintendo Entertainment System",
+        "nes_system",
+        "nes",
+        ["nes","fds","nsf"],
+        "SAVE_NES_",
+        "GG_NES_",
+        define="ENABLE_EMULATOR_NES",
+        compress=True,
+    ),
+    SystemSpec(
+        "Core/Src/retro-go/nes_bios.c",
+        "NES_BIOS",
+        "nes_bios",
+        "nes_bios",
+        ["rom","nes"],
+        "SAVE_NESB_",
+        bios_for="nes",
+    ),
+    SystemSpec(
+        "Core/Src/retro-go/sms_roms.c",
+        "Sega Master System",
+        "sms_system",
+        "sms",
+        ["sms"],
+        "SAVE_SMS_",
+        define="ENABLE_EMULATOR_SMS",
+        rom_cache=True,
+    ),
+    SystemSpec(
+        "Core/Src/retro-go/gg_roms.c",
+        "Sega Game Gear",
+        "gg_system",
+        "gg",
+        ["gg"],
+        "SAVE_GG_",
+        define="ENABLE_EMULATOR_GG",
+        rom_cache=True,
+    ),
+    SystemSpec(
+        "Core/Src/retro-go/md_roms.c",
+        "Sega Genesis",
+        "md_system",
+        "md",
+        ["md","gen","bin"],
+        "SAVE_MD_",
+        define="ENABLE_EMULATOR_MD",
+        rom_cache=True,
+    ),
+    SystemSpec(
+        "Core/Src/retro-go/col_roms.c",
+        "Colecovision",
+        "col_system",
+        "col",
+        ["col"],
+        "SAVE_COL_",
+        define="ENABLE_EMULATOR_COL",
+    ),
+    SystemSpec(
+        "Core/Src/retro-go/sg1000_roms.c",
+        "Sega SG-1000",
+        "sg1000_system",
+        "sg",
+        ["sg"],
+        "SAVE_SG1000_",
+        define="ENABLE_EMULATOR_SG1000",
+    ),
+    SystemSpec(
+        "Core/Src/retro-go/pce_roms.c",
+        "PC Engine",
+        "pce_system",
+        "pce",
+        ["pce"],
+        "SAVE_PCE_",
+        "GG_PCE_",
+        define="ENABLE_EMULATOR_PCE",
+        compress=True,
+    ),
+    SystemSpec(
+        "Core/Src/retro-go/gw_roms.c",
+        "Game & Watch",
+        "gw_system",
+        "gw",
+        ["gw"],
+        "SAVE_GW_",
+        define="ENABLE_EMULATOR_GW",
+    ),
+    SystemSpec(
+        "Core/Src/retro-go/msx_roms.c",
+        "MSX",
+        "msx_system",
+        "msx",
+        ["rom","mx1","mx2","dsk"],
+        "SAVE_MSX_",
+        "MCF_MSX_",
+        define="ENABLE_EMULATOR_MSX",
+        compress=True,
+    ),
+    SystemSpec(
+        "Core/Src/retro-go/msx_bios.c",
+        "MSX_BIOS",
+        "msx_bios",
+        "msx_bios",
+        ["rom"],
+        "SAVE_MSXB_",
+        bios_for="msx",
+        # Check that required bios files are here and patch files if needed
+        check=parse_msx_bios_files,
+    ),
+    SystemSpec(
+        "Core/Src/retro-go/wsv_roms.c",
+        "Watara Supervision",
+        "wsv_system",
+        "wsv",
+        ["bin","sv"],
+        "SAVE_WSV_",
+        define="ENABLE_EMULATOR_WSV",
+        compress=True,
+    ),
+    SystemSpec(
+        "Core/Src/retro-go/a7800_roms.c",
+        "Atari 7800",
+        "a7800_system",
+        "a7800",
+        ["a78","bin"],
+        "SAVE_A7800_",
+        define="ENABLE_EMULATOR_A7800",
+        compress=True,
+    ),
+    SystemSpec(
+        "Core/Src/retro-go/amstrad_roms.c",
+        "Amstrad CPC",
+        "amstrad_system",
+        "amstrad",
+        ["dsk"],
+        "SAVE_AMSTRAD_",
+        define="ENABLE_EMULATOR_AMSTRAD",
+        compress=True,
+    ),
+]
+
+
+# Cover art next to a rom, in order of preference
+COVER_SUFFIXES = (
+    ".png", ".PNG", ".Png",
+    ".jpg", ".JPG", ".Jpg",
+    ".jpeg", ".JPEG", ".Jpeg",
+    ".bmp", ".BMP", ".Bmp",
+)
+
+
 class NoArtworkError(Exception):
     """No artwork found for this ROM"""
 
@@ -280,24 +848,16 @@ class ROM:
         print("Found rom " + self.filename +" will display name as: " + self.romdef['name'])
         if not (self.publish):
             print("& will not Publish !")
-        obj_name = "".join([i if i.isalnum() else "_" for i in self.path.name])
+        obj_name = symbol_safe(self.path.name)
         self.obj_path = "build/roms/" + obj_name + ".o"
         symbol_path = str(self.path.parent) + "/" + obj_name
-        self.symbol = (
-            "_binary_"
-            + "".join([i if i.isalnum() else "_" for i in symbol_path])
-            + "_start"
-        )
+        self.symbol = "_binary_" + symbol_safe(symbol_path) + "_start"
 
         self.img_path = self.path.parent / (self.filename + ".img")
-        obj_name = "".join([i if i.isalnum() else "_" for i in self.img_path.name])
+        obj_name = symbol_safe(self.img_path.name)
         symbol_path = str(self.path.parent) + "/" + obj_name
         self.obj_img = "build/roms/" + obj_name + "_" + extension + ".o"
-        self.img_symbol = (
-            "_binary_"
-            + "".join([i if i.isalnum() else "_" for i in symbol_path])
-            + "_start"
-        )
+        self.img_symbol = "_binary_" + symbol_safe(symbol_path) + "_start"
 
     def __str__(self) -> str:
         return f"id: {self.rom_id} name: {self.name} size: {self.size} ext: {self.ext}"
@@ -308,108 +868,76 @@ class ROM:
     def read(self):
         return self.path.read_bytes()
 
+    def _limit_cheat_codes(self, codes_and_descs):
+        if len(codes_and_descs) > MAX_CHEAT_CODES:
+            print(
+                f"INFO: {self.name} has more than {MAX_CHEAT_CODES} cheat codes. Truncating..."
+            )
+            codes_and_descs = codes_and_descs[:MAX_CHEAT_CODES]
+        return codes_and_descs
+
+    def _read_cheat_file(self, suffix, encoding=None):
+        """Lines of the cheat file next to the rom, or None if there is none."""
+        try:
+            text = Path(self.path.parent, self.filename + suffix).read_text(encoding=encoding)
+        except FileNotFoundError:
+            return None
+        return text.splitlines()
+
     def get_rom_patchs(self):
         #get pce rompatchs files
-        pceplus = Path(self.path.parent, self.filename + ".pceplus")
-
-        if not os.path.exists(pceplus):
-            return []
+        return self._parse_rom_patchs(self._read_cheat_file(".pceplus") or [])
 
+    def _parse_rom_patchs(self, lines):
         codes_and_descs = []
-        for line in pceplus.read_text().splitlines():
+        for line in lines:
             line = line.strip()
             if not line:
                 continue
             if line.startswith("#"):
                 continue
             parts = line.split(',')
-            cmd_count = 0
-            cmd_str = ""
-            for i in range(len(parts) - 1):
-                part = parts[i].strip()
-                #get cmd byte count
-                x_str = part[0:2]
-                x = (int(x_str, 16) >> 4) + 1
-                one_cmd = ""
-                for y in range(3):
-                    one_cmd = one_cmd + "\\x" + part[y * 2: y * 2 + 2] 
-                for y in range(x):
-                    one_cmd = one_cmd + "\\x" + part[y * 2 + 6: y * 2 + 8]
-                #got one cmd
-                cmd_count += 1
-                cmd_str = cmd_str + one_cmd
-            cmd_str = "\\x%x" % (cmd_count) + cmd_str
-            desc = parts[len(parts) - 1]
-            if desc is not None:
-                desc = desc[:40]
-                desc = desc.replace('\\', r'\\\\')
-                desc = desc.replace('"', r'\"')
-                desc = desc.strip()
+            cmds = []
+            for part in parts[:-1]:
+                part = part.strip()
+                #get cmd byte count, following the 3 bytes of address
+                x = (int(part[0:2], 16) >> 4) + 1
+                cmds.append(_HEX_BYTE_RE.sub(r"\\x\g<0>", part[: (3 + x) * 2]))
+            cmd_str = "\\x%x" % len(cmds) + "".join(cmds)
+            desc = _cheat_desc(parts[-1])
 
             codes_and_descs.append((cmd_str, desc))
 
-        if len(codes_and_descs) > MAX_CHEAT_CODES:
-            print(
-                f"INFO: {self.name} has more than {MAX_CHEAT_CODES} cheat codes. Truncating..."
-            )
-            codes_and_descs = codes_and_descs[:MAX_CHEAT_CODES]
-
-        return codes_and_descs
+        return self._limit_cheat_codes(codes_and_descs)
 
     def get_cheat_codes(self):
-        # Get game genie code file path
-        gg_path = Path(self.path.parent, self.filename + ".ggcodes")
-
-        if os.path.exists(gg_path):
+        # Get game genie codes
+        lines = self._read_cheat_file(".ggcodes")
+        if lines is not None:
             codes_and_descs = []
-            for line in gg_path.read_text().splitlines():
-                line = line.strip()
-                if not line:
-                    continue
-                parts = line.split(',', 1)
-                code = parts[0]
-                desc = None
-                if len(parts)>1:
-                    desc = parts[1]
-
-                # Remove whitespace
-                code = "".join(code.split())
+            for line in lines:
+                code, sep, desc = line.strip().partition(',')
+                # Remove whitespace and capitalize letters
+                code = _WHITESPACE_RE.sub("", code).upper()
                 # Remove empty lines
                 if code == "":
                     continue
-                # Capitalize letters
-                code = code.upper()
-
-                # Shorten description
-                if desc is not None:
-                    desc = desc[:40]
-                    desc = desc.replace('\\', r'\\\\')
-                    desc = desc.replace('"', r'\"')
-                    desc = desc.strip()
 
-                codes_and_descs.append((code, desc))
-
-            if len(codes_and_descs) > MAX_CHEAT_CODES:
-                print(
-                    f"INFO: {self.name} has more than {MAX_CHEAT_CODES} cheat codes. Truncating..."
-                )
-                codes_and_descs = codes_and_descs[:MAX_CHEAT_CODES]
+                codes_and_descs.append((code, _cheat_desc(desc if sep else None)))
 
-            return codes_and_descs
+            return self._limit_cheat_codes(codes_and_descs)
 
-        pceplus = Path(self.path.parent, self.filename + ".pceplus")
-        if os.path.exists(pceplus):
-            return self.get_rom_patchs()
+        lines = self._read_cheat_file(".pceplus")
+        if lines is not None:
+            return self._parse_rom_patchs(lines)
 
-        mfc_path = Path(self.path.parent, self.filename + ".mcf")
-        if os.path.exists(mfc_path):
+        lines = self._read_cheat_file(".mcf", encoding="cp1252")
+        if lines is not None:
             codes_and_descs = []
-            for line in mfc_path.read_text(encoding="cp1252").splitlines():
+            for line in lines:
                 line = line.strip()
-                if not line:
-                    continue
-                # Check if it's a comment
-                if line[0] == '!':
+                # Skip empty lines and comments
+                if not line or line[0] == '!':
                     continue
                 parts = line.split(',', 4)
                 if len(parts) == 5:
@@ -419,26 +947,6 @@ class ROM:
                     elif int(parts[2]) > 0xffff:
                         length = 4
                     code = parts[1]+','+parts[2]+','+str(length)
-                    desc = None
-                    if len(parts)>4:
-                        desc = parts[4]
-
-                    # Remove whitespace
-                    code = "".join(code.split())
-                    # Remove empty lines
-                    if code == "":
-                        continue
-                    # Capitalize letters
-                    code = code.upper()
-
-                    # Shorten description
-                    if desc is not None:
-                        desc = desc[:40]
-                        desc = desc.replace('\\', r'\\\\')
-                        desc = desc.replace('"', r'\"')
-                        desc = desc.strip()
-
-                    codes_and_descs.append((code, desc))
                 elif len(parts) == 1:
                     parts = line.split(':', 4)
                     if int(parts[2]) == 0:
@@ -449,58 +957,40 @@ class ROM:
                         length = 4
 
                     code = str(int(parts[0], base=16))+','+str(int(parts[1], base=16))+','+str(length)
-                    desc = None
-                    if len(parts)>4:
-                        desc = parts[4]
-
-                    # Remove whitespace
-                    code = "".join(code.split())
-                    # Remove empty lines
-                    if code == "":
-                        continue
-                    # Capitalize letters
-                    code = code.upper()
-
-                    # Shorten description
-                    if desc is not None:
-                        desc = desc[:40]
-                        desc = desc.replace('\\', r'\\\\')
-                        desc = desc.replace('"', r'\"')
-                        desc = desc.strip()
-
-                    codes_and_descs.append((code, desc))
-
-
-            if len(codes_and_descs) > MAX_CHEAT_CODES:
-                print(
-                    f"INFO: {self.name} has more than {MAX_CHEAT_CODES} cheat codes. Truncating..."
-                )
-                codes_and_descs = codes_and_descs[:MAX_CHEAT_CODES]
+                else:
+                    continue
+                desc = parts[4] if len(parts) > 4 else None
+
+                # Remove whitespace and capitalize letters
+                code = _WHITESPACE_RE.sub("", code).upper()
+                # Remove empty lines
+                if code == "":
+                    continue
+
+                codes_and_descs.append((code, _cheat_desc(desc)))
 
-            return codes_and_descs
+            return self._limit_cheat_codes(codes_and_descs)
 
         # No cheat file found
         return []
 
-    @property
+    @cached_property
     def ext(self):
         return self.path.suffix[1:].lower()
 
-    @property
+    @cached_property
     def size(self):
         return self.path.stat().st_size
 
-    @property
-    def mapper(self):
+    def get_mapper(self):
         mapper = 0
         if self.system_name == "MSX":
             mapper = int(subprocess.check_output([sys.executable, "./tools/findblueMsxMapper.py", "roms/msx_bios/msxromdb.xml", str(self.path).replace('.dsk.cdk','.dsk').replace('.lzma','')]))
         if self.system_name == "Nintendo Entertainment System":
-            mapper = int(subprocess.check_output([sys.executable, "./fceumm-go/nesmapper.py", "mapper", str(self.path).replace('.lzma','')]))
+            mapper = run_nesmapper("mapper", str(self.path).replace('.lzma',''))
         return mapper
 
-    @property
-    def game_config(self):
+    def get_game_config(self):
         value = 0xff
         if self.system_name == "MSX":
             # MSX game_config structure :
@@ -511,7 +1001,7 @@ class ROM:
             if int(sp_output[0]) == 0xff :
                 print(f"Warning : {self.name} has no controls configuration in roms/msx_bios/msxromdb.xml, default controls will be used")
         return value
-    @property
+    @cached_property
     def img_size(self):
         try:
             return self.img_path.stat().st_size
@@ -521,19 +1011,68 @@ class ROM:
 
 class ROMParser:
     global sms_reserved_flash_size
+    def __init__(self):
+        self._compress_executor = None
+        self._compress_executor_lock = threading.Lock()
+        # Objects for build/roms.a, archived together by write_archive()
+        self.archive_objects = []
+        self._objcopy_executor = ThreadPoolExecutor(max_workers=os.cpu_count())
+        self._objcopy_jobs = []
+        # Files of each roms folder, listed once by _list_rom_files()
+        self._rom_files = {}
+
+    def compress_executor(self) -> ProcessPoolExecutor:
+        """Process pool shared by all systems, started on first use."""
+        with self._compress_executor_lock:
+            if self._compress_executor is None:
+                # Not forked: by then the objcopy threads may already be running
+                self._compress_executor = ProcessPoolExecutor(
+                    max_workers=args.jobs,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_compress_worker,
+                    initargs=(args,),
+                )
+        return self._compress_executor
+
+    def _cancel_pending(self, executor: ThreadPoolExecutor):
+        """Drop the work not started yet, the running systems stop on it."""
+        executor.shutdown(wait=False, cancel_futures=True)
+        with self._compress_executor_lock:
+            if self._compress_executor is not None:
+                self._compress_executor.shutdown(wait=False, cancel_futures=True)
+
+    def _list_rom_files(self, folder: str):
+        """Sorted paths of the files in a roms folder.
+
+        The listing is kept until _forget_rom_files() is called for the
+        folder, after files were added to it.
+        """
+        if folder not in self._rom_files:
+            script_path = Path(__file__).parent
+            roms_folder = script_path / "roms" / folder
+
+            # scandir already knows the file types from reading the directory
+            with os.scandir(roms_folder) as entries:
+                self._rom_files[folder] = sorted(
+                    Path(e.path) for e in entries if e.is_file()
+                )
+        return self._rom_files[folder]
+
+    def _forget_rom_files(self, folder: str):
+        self._rom_files.pop(folder, None)
+
     def find_roms(self, system_name: str, folder: str, extension: str, romdefs: dict) -> [ROM]:
         extension = extension.lower()
         ext = extension
         if not extension.startswith("."):
             extension = "." + extension
 
-        script_path = Path(__file__).parent
-        roms_folder = script_path / "roms" / folder
-
         # find all files that end with extension (case-insensitive)
-        rom_files = list(roms_folder.iterdir())
-        rom_files = [r for r in rom_files if r.name.lower().endswith(extension)]
-        rom_files.sort()
+        rom_files = [
+            path
+            for path in self._list_rom_files(folder)
+            if path.name[-len(extension):].lower() == extension
+        ]
         found_roms = [ROM(system_name, rom_file, ext, romdefs) for rom_file in rom_files]
         for rom in found_roms:
             suffix = "_no_save"
@@ -546,30 +1085,28 @@ class ROMParser:
     def generate_rom_entries(
         self, name: str, roms: [ROM], save_prefix: str, system: str, cheat_codes_prefix: str
     ) -> str:
-        body = ""
+        # mapper and game_config may each run a helper script per rom,
+        # run those concurrently rather than one interpreter start at a time
+        published = [rom for rom in roms if rom.publish]
+        with ThreadPoolExecutor() as executor:
+            rom_configs = dict(zip(
+                published,
+                executor.map(lambda rom: (rom.get_mapper(), rom.get_game_config()), published),
+            ))
+
+        body = []
         pubcount = 0
         for i in range(len(roms)):
             rom = roms[i]
             if not (rom.publish):
                 continue
-            is_pal = any(
-                substring in rom.filename
-                for substring in [
-                    "(E)",
-                    "(Europe)",
-                    "(Sweden)",
-                    "(Germany)",
-                    "(Italy)",
-                    "(France)",
-                    "(A)",
-                    "(Australia)",
-                ]
-            )
+            is_pal = PAL_REGION_RE.search(rom.filename) is not None
             region = "REGION_PAL" if is_pal else "REGION_NTSC"
             gg_count_name = "%s%s_COUNT" % (cheat_codes_prefix, i)
             gg_code_array_name = "%sCODE_%s" % (cheat_codes_prefix, i)
             gg_desc_array_name = "%sDESC_%s" % (cheat_codes_prefix, i)
-            body += ROM_ENTRY_TEMPLATE.format(
+            mapper, game_config = rom_configs[rom]
+            body.append(ROM_ENTRY_TEMPLATE.format(
                 rom_id=rom.rom_id,
                 name=str(rom.name),
                 size=rom.size,
@@ -584,13 +1121,13 @@ class ROMParser:
                 cheat_codes=gg_code_array_name if cheat_codes_prefix else "NULL",
                 cheat_descs=gg_desc_array_name if cheat_codes_prefix else 0,
                 cheat_count=gg_count_name if cheat_codes_prefix else 0,
-                mapper=rom.mapper,
-                game_config=rom.game_config,
-            )
-            body += "\n"
+                mapper=mapper,
+                game_config=game_config,
+            ))
+            body.append("\n")
             pubcount += 1
 
-        return ROM_ENTRIES_TEMPLATE.format(name=name, body=body, rom_count=pubcount)
+        return ROM_ENTRIES_TEMPLATE.format(name=name, body="".join(body), rom_count=pubcount)
 
     def generate_object_file(self, rom: ROM,system_name) -> str:
         # convert rom to an .o file and place the data in the .extflash_game_rom section
@@ -599,7 +1136,7 @@ class ROMParser:
             prefix = os.environ["GCC_PATH"]
         prefix = Path(prefix)
         if system_name == "Sega Genesis":
-            subprocess.check_output(
+            self._run_objcopy(
                 [
                     prefix / "arm-none-eabi-objcopy",
                     "--rename-section",
@@ -616,7 +1153,7 @@ class ROMParser:
                 ]
             )
         else:
-            subprocess.check_output(
+            self._run_objcopy(
                 [
                     prefix / "arm-none-eabi-objcopy",
                     "--rename-section",
@@ -631,14 +1168,7 @@ class ROMParser:
                     rom.obj_path,
                 ]
             )
-        subprocess.check_output(
-            [
-                prefix / "arm-none-eabi-ar",
-                "-cr",
-                "build/roms.a",
-                rom.obj_path,
-            ]
-        )
+        self.archive_objects.append(rom.obj_path)
         template = "extern const uint8_t {name}[];\n"
         return template.format(name=rom.symbol)
 
@@ -650,30 +1180,19 @@ class ROMParser:
 
         prefix = Path(prefix)
 
-        imgs = []
-        imgs.append(str(rom.img_path.with_suffix(".png")))
-        imgs.append(str(rom.img_path.with_suffix(".PNG")))
-        imgs.append(str(rom.img_path.with_suffix(".Png")))
-        imgs.append(str(rom.img_path.with_suffix(".jpg")))
-        imgs.append(str(rom.img_path.with_suffix(".JPG")))
-        imgs.append(str(rom.img_path.with_suffix(".Jpg")))
-        imgs.append(str(rom.img_path.with_suffix(".jpeg")))
-        imgs.append(str(rom.img_path.with_suffix(".JPEG")))
-        imgs.append(str(rom.img_path.with_suffix(".Jpeg")))
-        imgs.append(str(rom.img_path.with_suffix(".bmp")))
-        imgs.append(str(rom.img_path.with_suffix(".BMP")))
-        imgs.append(str(rom.img_path.with_suffix(".Bmp")))
-
-        for img in imgs:
-            if Path(img).exists():
-                write_covart(Path(img), rom.img_path, w, h, args.jpg_quality)
+        for suffix in COVER_SUFFIXES:
+            img = rom.img_path.with_suffix(suffix)
+            if img.exists():
+                write_covart(img, rom.img_path, w, h, args.jpg_quality)
+                # Forget the size cached before the cover was (re)generated
+                rom.__dict__.pop("img_size", None)
                 break
 
         if not rom.img_path.exists():
             raise NoArtworkError
 
         print(f"INFO: Packing {rom.name} Cover> {rom.img_path} ...")
-        subprocess.check_output(
+        self._run_objcopy(
             [
                 prefix / "arm-none-eabi-objcopy",
                 "--rename-section",
@@ -688,23 +1207,55 @@ class ROMParser:
                 rom.obj_img,
             ]
         )
-        subprocess.check_output(
-            [
-                prefix / "arm-none-eabi-ar",
-                "-cru",
-                "build/roms.a",
-                rom.obj_img,
-            ]
-        )
+        self.archive_objects.append(rom.obj_img)
         template = "extern const uint8_t {name}[];\n"
         return template.format(name=rom.img_symbol)
 
+    def _run_objcopy(self, command):
+        # Each objcopy is its own process, let them run side by side
+        self._objcopy_jobs.append(
+            self._objcopy_executor.submit(subprocess.check_output, command)
+        )
+
+    def write_archive(self):
+        # Wait for all objects, re-raising any objcopy failure
+        for job in self._objcopy_jobs:
+            job.result()
+        self._objcopy_executor.shutdown()
+
+        # A single ar call per command line worth of objects, rather than one
+        # per rom that each rewrite the whole archive
+        prefix = ""
+        if "GCC_PATH" in os.environ:
+            prefix = os.environ["GCC_PATH"]
+        prefix = Path(prefix)
+
+        try:
+            arg_max = os.sysconf("SC_ARG_MAX")
+        except (AttributeError, ValueError, OSError):
+            arg_max = 32 * 1024  # Windows command line limit
+        # Leave room for the environment, which shares the same space
+        arg_max //= 2
+
+        batches = []
+        batch_len = arg_max
+        for obj in self.archive_objects:
+            if batch_len + len(str(obj)) + 1 > arg_max:
+                batches.append([])
+                batch_len = 0
+            batches[-1].append(obj)
+            batch_len += len(str(obj)) + 1
+
+        # "s" writes the symbol index, so no separate ranlib run is needed
+        for batch in batches:
+            subprocess.check_output(
+                [prefix / "arm-none-eabi-ar", "rcs", "build/roms.a", *batch]
+            )
+
     def generate_save_entry(self, name: str, save_size: int) -> str:
         return f'uint8_t {name}[{save_size}]  __attribute__((section (".saveflash"))) __attribute__((aligned(4096)));\n'
 
     def generate_cheat_entry(self, name: str, num: int, cheat_codes_and_descs: []) -> str:
-        str = ""
-
         codes = "{%s}" % ",".join(f'"{c}"' for (c,d) in cheat_codes_and_descs)
         descs = "{%s}" % ",".join(f'NULL' if d is None else f'"{d}"' for (c,d) in cheat_codes_and_descs)
         number_of_codes = len(cheat_codes_and_descs)
@@ -712,21 +1263,24 @@ class ROMParser:
         count_name = "%s%s_COUNT" % (name, num)
         code_array_name = "%sCODE_%s" % (name, num)
         desc_array_name = "%sDESC_%s" % (name, num)
-        str += f'#if CHEAT_CODES == 1\n'
-        str += f'const char* {code_array_name}[{number_of_codes}] = {codes};\n'
-        str += f'const char* {desc_array_name}[{number_of_codes}] = {descs};\n'
-        str += f'const int {count_name} = {number_of_codes};\n'
-        str += f'#endif\n'
-
-        return str
+        return "".join([
+            f'#if CHEAT_CODES == 1\n',
+            f'const char* {code_array_name}[{number_of_codes}] = {codes};\n',
+            f'const char* {desc_array_name}[{number_of_codes}] = {descs};\n',
+            f'const int {count_name} = {number_of_codes};\n',
+            f'#endif\n',
+        ])
 
     def get_gameboy_save_size(self, file: Path):
-        total_size = 4096
         file = Path(file)
 
         if file.suffix in COMPRESSIONS:
             file = file.with_suffix("")  # Remove compression suffix
 
+        return cached_for_file(SAVE_SIZE_CACHE_FILE, file, self._read_gameboy_save_size)
+
+    def _read_gameboy_save_size(self, file: Path):
+        total_size = 4096
         with open(file, "rb") as f:
             # cgb
             f.seek(0x143)
@@ -760,12 +1314,41 @@ class ROMParser:
         if file.suffix in COMPRESSIONS:
             file = file.with_suffix("")  # Remove compression suffix
 
-        total_size = int(subprocess.check_output([sys.executable, "./fceumm-go/nesmapper.py", "savesize", file]))
-        return total_size
+        # nesmapper parses the whole rom, keep its answer while neither the rom
+        # nor nesmapper change
+        return cached_for_file(
+            SAVE_SIZE_CACHE_FILE,
+            file,
+            partial(run_nesmapper, "savesize"),
+            depends=[NESMAPPER_SCRIPT],
+        )
 
-        return 0
-    def _compress_rom(self, variable_name, rom, compress_gb_speed=False, compress=None):
-        """This will create a compressed rom file next to the original rom."""
+    # _compress_rom and _convert_dsk run in worker processes, they and
+    # _compress_banks are static so no ROMParser is built there
+
+    @staticmethod
+    def _compress_banks(compress, banks, bank_map=map):
+        # Identical banks, like the empty ones padding many roms, are only
+        # compressed once. Read-only memoryviews hash and compare by content.
+        unique_banks = dict.fromkeys(banks)
+        to_compress = list(unique_banks)
+        # A handful of banks isn't worth the round trip to worker processes
+        if len(to_compress) < 4:
+            bank_map = map
+        elif bank_map is not map:
+            # memoryviews can't be pickled over to the workers
+            to_compress = [bytes(bank) for bank in to_compress]
+        for bank, compressed_bank in zip(unique_banks, bank_map(compress, to_compress)):
+            unique_banks[bank] = compressed_bank
+        return [unique_banks[bank] for bank in banks]
+
+    @staticmethod
+    def _compress_rom(variable_name, rom, compress_gb_speed=False, compress=None, compress_level=None, bank_map=map):
+        """This will create a compressed rom file next to the original rom.
+
+        Banks of bank switched roms are compressed through ``bank_map``, which
+        can spread them over worker processes. Returns True when the rom was
+        left uncompressed because it doesn't compress."""
         global sms_reserved_flash_size
         if not (rom.publish):
             return
@@ -778,83 +1361,72 @@ class ROMParser:
         if compress[0] != ".":
             compress = "." + compress
         output_file = Path(str(rom.path) + compress)
-        compress = COMPRESSIONS[compress]
-        data = rom.read()
-
+        compress = partial(
+            cached_compress, compress=COMPRESSIONS[compress], level=compress_level
+        )
+        # Whole rom systems are limited to what their emulator can decompress,
+        # checked up front so too-large roms are never read in
         if "nes_system" in variable_name:  # NES
-            if rom.path.stat().st_size > MAX_COMPRESSED_NES_SIZE:
-                print(
-                    f"INFO: {rom.name} is too large to compress, skipping compression!"
-                )
-                return
-            compressed_data = compress(data)
-            output_file.write_bytes(compressed_data)
+            max_size = MAX_COMPRESSED_NES_SIZE
         elif "pce_system" in variable_name:  # PCE
-            if rom.path.stat().st_size > MAX_COMPRESSED_PCE_SIZE:
-                print(
-                    f"INFO: {rom.name} is too large to compress, skipping compression!"
-                )
-                return
-            compressed_data = compress(data)
-            output_file.write_bytes(compressed_data)
+            max_size = MAX_COMPRESSED_PCE_SIZE
         elif "msx_system" in variable_name:  # MSX
-            if rom.path.stat().st_size > MAX_COMPRESSED_MSX_SIZE:
-                print(
-                    f"INFO: {rom.name} is too large to compress, skipping compression!"
-                )
-                return
-            compressed_data = compress(data)
-            output_file.write_bytes(compressed_data)
+            max_size = MAX_COMPRESSED_MSX_SIZE
         elif "wsv_system" in variable_name:  # WSV
-            if rom.path.stat().st_size > MAX_COMPRESSED_WSV_SIZE:
-                print(
-                    f"INFO: {rom.name} is too large to compress, skipping compression!"
-                )
-                return
-            compressed_data = compress(data)
-            output_file.write_bytes(compressed_data)
+            max_size = MAX_COMPRESSED_WSV_SIZE
         elif "a7800_system" in variable_name:  # Atari 7800
-            if rom.path.stat().st_size > MAX_COMPRESSED_A7800_SIZE:
-                print(
-                    f"INFO: {rom.name} is too large to compress, skipping compression!"
-                )
-                return
-            compressed_data = compress(data)
-            output_file.write_bytes(compressed_data)
+            max_size = MAX_COMPRESSED_A7800_SIZE
         elif variable_name in ["col_system","sg1000_system"] :  # COL or SG
-            if rom.path.stat().st_size > MAX_COMPRESSED_SG_COL_SIZE:
-                print(
-                    f"INFO: {rom.name} is too large to compress, skipping compression!"
-                )
-                return
+            max_size = MAX_COMPRESSED_SG_COL_SIZE
+        elif variable_name in ["sms_system","gg_system","md_system"] or "gb_system" in variable_name:
+            max_size = None  # compressed bank by bank
+        else:
+            return
+
+        if max_size is not None and rom.size > max_size:
+            print(
+                f"INFO: {rom.name} is too large to compress, skipping compression!"
+            )
+            return
+
+        data = rom.read()
+        # The uncompressed rom is used when there is no compressed one
+        if is_incompressible(data):
+            print(
+                f"INFO: {rom.name} doesn't compress, skipping compression!"
+            )
+            return True
+
+        if max_size is not None:
             compressed_data = compress(data)
             output_file.write_bytes(compressed_data)
-
         elif variable_name in ["sms_system","gg_system","md_system"]:  # GG or SMS or MD
 
             BANK_SIZE = 128*1024
-            banks = [data[i : i + BANK_SIZE] for i in range(0, len(data), BANK_SIZE)]
-            compressed_banks = [compress(bank) for bank in banks]
+            # Views into data, the compressors take any buffer without a copy
+            rom_view = memoryview(data)
+            banks = [rom_view[i : i + BANK_SIZE] for i in range(0, len(data), BANK_SIZE)]
+            compressed_banks = ROMParser._compress_banks(compress, banks, bank_map)
 
             # add header + number of banks + banks(offset)
-            output_data=[]
-            output_data.append( b'SMS+')
-            output_data.append(pack("<l", len(compressed_banks)))
-
-            for compressed_bank in compressed_banks:
-                output_data.append(pack("<l", len(compressed_bank)))
-
-            # Reassemble all banks back into one file
-            for compressed_bank in compressed_banks:
-                output_data.append(compressed_bank)
-
-            output_data = b"".join(output_data)
-
-            output_file.write_bytes(output_data)
+            header = bytearray(BANK_HEADER.size * (1 + len(compressed_banks)))
+            BANK_HEADER.pack_into(header, 0, len(compressed_banks))
+            for i, compressed_bank in enumerate(compressed_banks, 1):
+                BANK_HEADER.pack_into(header, i * BANK_HEADER.size, len(compressed_bank))
+
+            with open(output_file, "wb", buffering=1 << 20) as f:
+                f.write(b'SMS+')
+                f.write(header)
+
+                # Reassemble all banks back into one file
+                for compressed_bank in compressed_banks:
+                    f.write(compressed_bank)
         elif "gb_system" in variable_name:  # GB/GBC
             BANK_SIZE = 16384
-            banks = [data[i : i + BANK_SIZE] for i in range(0, len(data), BANK_SIZE)]
-            compressed_banks = [compress(bank) for bank in banks]
+            # Views into data, the compressors take any buffer without a copy
+            rom_view = memoryview(data)
+            banks = [rom_view[i : i + BANK_SIZE] for i in range(0, len(data), BANK_SIZE)]
+            compressed_banks = ROMParser._compress_banks(compress, banks, bank_map)
 
             # For ROM having continous bank switching we can use 'partial' compression
             # a mix of comcompressed and uncompress
@@ -864,45 +1436,45 @@ class ROMParser:
 
             # START : ALTERNATIVE COMPRESSION STRATEGY
             if compress_gb_speed:
-                # the larger banks only are compressed.
-                # It shoul fit exactly in the cache reducing the SWAP cache feequency to 0.
+                # Every compressed bank takes a whole slot of the bank cache
+                # once decompressed, so the budget is a number of banks. Spend
+                # it on the banks that compress best: the largest threshold
+                # below which no more than GB_CACHE_SLOTS banks fall. The
+                # others stay uncompressed and never need decompressing.
                 # any empty bank is compressed (=98bytes). considered never used by MBC.
+                ordered_size = sorted(
+                    size for size in map(len, compressed_banks[1:]) if size > 98
+                )
 
-                # Ths is the cache size used as a compression credit
-                # TODO : can we the value from the linker ?
-                compression_credit = 26
-                compress_size = [len(bank) for bank in compressed_banks[1:]]
-
-                # to keep empty banks compressed (size=98)
-                compress_size = [i for i in compress_size if i > 98]
-
-                ordered_size = sorted(compress_size)
-
-                if compression_credit > len(ordered_size):
-                    compression_credit = len(ordered_size) - 1
-
-                compress_threshold = ordered_size[int(compression_credit)]
-
-                for i, bank in enumerate(compressed_banks):
-                    if len(bank) >= compress_threshold:
-                        # Don't compress banks with poor compression
-                        compress_its[i] = False
+                if len(ordered_size) > GB_CACHE_SLOTS:
+                    compress_threshold = ordered_size[GB_CACHE_SLOTS]
+                    for i, bank in enumerate(compressed_banks):
+                        if len(bank) >= compress_threshold:
+                            # Don't compress banks with poor compression
+                            compress_its[i] = False
+                else:
+                    # All banks fit in the cache
+                    compress_threshold = None
+
+                if args.verbose:
+                    print(
+                        f"{rom.name}: {len(ordered_size)} used banks, "
+                        f"compress_threshold={compress_threshold}"
+                    )
             # END : ALTERNATIVE COMPRESSION STRATEGY
 
             # Reassemble all banks back into one file
-            output_banks = []
-            for bank, compressed_bank, compress_it in zip(
-                banks, compressed_banks, compress_its
-            ):
-                if compress_it:
-                    output_banks.append(compressed_bank)
-                else:
-                    output_banks.append(compress(bank, level=DONT_COMPRESS))
-            output_data = b"".join(output_banks)
-
-            output_file.write_bytes(output_data)
-
-    def _convert_dsk(self, variable_name, dsk, compress):
+            with open(output_file, "wb", buffering=1 << 20) as f:
+                for bank, compressed_bank, compress_it in zip(
+                    banks, compressed_banks, compress_its
+                ):
+                    if compress_it:
+                        f.write(compressed_bank)
+                    else:
+                        f.write(compress(bank, level=DONT_COMPRESS))
+
+    @staticmethod
+    def _convert_dsk(variable_name, dsk, compress):
         """This will convert dsk image to cdk."""
         if not (dsk.publish):
             return
@@ -910,38 +1482,32 @@ class ROMParser:
             compress="none"
 
         if "msx_system" in variable_name:  # MSX disk compression
-            subprocess.check_output("python3 tools/dsk2lzma.py \""+str(dsk.path)+"\" "+compress, shell=True)
+            run_dsk_converter("tools/dsk2lzma.py", dsk.path, compress)
 
         if "amstrad_system" in variable_name:  # Amstrad disk compression
-            subprocess.check_output("python3 tools/amdsk2lzma.py \""+str(dsk.path)+"\" "+compress, shell=True)
+            run_dsk_converter("tools/amdsk2lzma.py", dsk.path, compress)
 
-    def generate_system(
+    def prepare_system(
         self,
-        file: str,
         system_name: str,
         variable_name: str,
         folder: str,
         extensions: List[str],
-        save_prefix: str,
         romdefs: dict,
-        cheat_codes_prefix: str,
-        current_id: int,
         compress: str = None,
         compress_gb_speed: bool = False,
-    ) -> int:
-        import json;
+    ):
+        """Find, convert and compress the roms of a system.
+
+        Doesn't depend on any other system, so parse() runs these concurrently.
+        Returns the roms to publish, the uncompressed roms and the romdefs.
+        """
         script_path = Path(__file__).parent
-        json_file = script_path / "roms" / str(folder + ".json")
+        json_file = script_path / "roms" / f"{folder}.json"
         print(json_file)
-        if Path(json_file).exists():
-            with open(json_file,'r') as load_f:
-                try:
-                    romdef = json.load(load_f)
-                    load_f.close()
-                    romdefs = romdef
-                except: 
-                    load_f.close()
- 
+        if json_file.exists():
+            romdefs = load_json(json_file)
+
         roms_raw = []
         for e in extensions:
             roms_raw += self.find_roms(system_name, folder, e, romdefs)
@@ -978,71 +1544,139 @@ class ROMParser:
                     disk.enable_save = False
             return disks
 
-        def contains_rom_by_name(rom, roms):
-            for r in roms:
-                if r.name == rom.name:
-                    return True
-            return False
-
         cdk_disks = find_cdk_disks()
 
-        disks_raw = [r for r in roms_raw if not contains_rom_by_name(r, cdk_disks)]
+        cdk_names = {d.name for d in cdk_disks}
+        disks_raw = [r for r in roms_raw if r.name not in cdk_names]
         disks_raw = [r for r in disks_raw if r.ext == "dsk"]
 
         if disks_raw:
-            pbar = tqdm(disks_raw) if tqdm else disks_raw
-            for r in pbar:
-                if tqdm:
-                    pbar.set_description(f"Converting: {system_name} / {r.name}")
-                self._convert_dsk(
-                    variable_name,
-                    r,
-                    compress)
+            # Disks convert independently, spread them over the worker processes
+            results = self.compress_executor().map(
+                partial(ROMParser._convert_dsk, variable_name, compress=compress), disks_raw
+            )
+            if tqdm:
+                results = tqdm(
+                    results,
+                    total=len(disks_raw),
+                    desc=f"Converting: {system_name}",
+                )
+            for _ in results:
+                pass
             # Re-generate the cdk disks list
+            self._forget_rom_files(folder)
             cdk_disks = find_cdk_disks()
         #remove .dsk from list
-        roms_raw = [r for r in roms_raw if not contains_rom_by_name(r, cdk_disks)]
+        cdk_names = {d.name for d in cdk_disks}
+        roms_raw = [r for r in roms_raw if r.name not in cdk_names]
         #add .cdk disks to list
         roms_raw.extend(cdk_disks)
 
         roms_compressed = find_compressed_roms()
 
-        roms_raw = [r for r in roms_raw if not contains_rom_by_name(r, roms_compressed)]
-        if roms_raw and compress is not None:
-            pbar = tqdm(roms_raw) if tqdm else roms_raw
-            for r in pbar:
-                if tqdm:
-                    pbar.set_description(f"Compressing: {system_name} / {r.name}")
-                self._compress_rom(
+        compressed_names = {r.name for r in roms_compressed}
+        roms_raw = [r for r in roms_raw if r.name not in compressed_names]
+        # Roms found incompressible by an earlier build are left as they are
+        roms_to_compress = [
+            r for r in roms_raw
+            if lookup_for_file(INCOMPRESSIBLE_CACHE_FILE, r.path) is None
+        ]
+        if roms_to_compress and compress is not None:
+            executor = self.compress_executor()
+            # Only these are compressed bank by bank, others in one piece
+            banked = variable_name in ["sms_system","gg_system","md_system"] or "gb_system" in variable_name
+            if not banked or len(roms_to_compress) >= args.jobs:
+                # Every rom compresses independently, so spread them over all cores
+                compress_one = partial(
+                    _compress_one,
                     variable_name,
-                    r,
                     compress_gb_speed=compress_gb_speed,
                     compress=compress,
+                    compress_level=args.compress_level,
                 )
+                results = executor.map(compress_one, roms_to_compress)
+            else:
+                # Too few roms to keep every core busy, spread their banks instead
+                bank_map = partial(executor.map, chunksize=4)
+                results = (
+                    (
+                        self._compress_rom(
+                            variable_name,
+                            r,
+                            compress_gb_speed=compress_gb_speed,
+                            compress=compress,
+                            compress_level=args.compress_level,
+                            bank_map=bank_map,
+                        ),
+                        "",  # printed here already
+                    )
+                    for r in roms_to_compress
+                )
+            if tqdm:
+                results = tqdm(
+                    results,
+                    total=len(roms_to_compress),
+                    desc=f"Compressing: {system_name}",
+                )
+            for r, (incompressible, printed) in zip(roms_to_compress, results):
+                print(printed, end="")
+                if incompressible:
+                    store_for_file(INCOMPRESSIBLE_CACHE_FILE, r.path, True)
             # Re-generate the compressed rom list
+            self._forget_rom_files(folder)
             roms_compressed = find_compressed_roms()
 
         # Create a list with all compressed roms and roms that
         # don't have a compressed counterpart.
+        compressed_names = {r.name for r in roms_compressed}
         roms = roms_compressed[:]
-        for r in roms_raw:
-            if not contains_rom_by_name(r, roms_compressed):
-                roms.append(r)
+        roms.extend(r for r in roms_raw if r.name not in compressed_names)
+        return roms, roms_uncompressed, romdefs
+
+    def generate_system(
+        self,
+        file: str,
+        system_name: str,
+        variable_name: str,
+        folder: str,
+        extensions: List[str],
+        save_prefix: str,
+        romdefs: dict,
+        cheat_codes_prefix: str,
+        current_id: int,
+        compress: str = None,
+        compress_gb_speed: bool = False,
+        prepared=None,
+    ) -> int:
+        """Assign rom ids from current_id and write the system's .c file.
+
+        prepared is the result of prepare_system() when it already ran,
+        otherwise it is run here with extensions, compress and compress_gb_speed.
+        """
+        if prepared is None:
+            prepared = self.prepare_system(
+                system_name,
+                variable_name,
+                folder,
+                extensions,
+                romdefs,
+                compress,
+                compress_gb_speed,
+            )
+        roms, roms_uncompressed, romdefs = prepared
 
         for rom in roms:
             rom.rom_id = current_id
             current_id += 1
 
-        system_save_size = 0
-        total_save_size = 0
-        total_rom_size = 0
+        # Indexes are kept, they name the save and cheat symbols of a rom
+        published = [(i, rom) for i, rom in enumerate(roms) if rom.publish]
+        pubcount = len(published)
+        total_rom_size = sum(rom.size for _, rom in published)
         total_img_size = 0
-        pubcount = 0
-        for i, rom in enumerate(roms):
-            if not (rom.publish):
-                continue
-            else:
-               pubcount += 1
+        if (args.coverflow != 0) :
+            total_img_size = sum(rom.img_size for _, rom in published)
+        rom_save_sizes = []
 
         save_size = SAVE_SIZES.get(folder, 0)
         romdefs.setdefault("_cover_width", 128)
@@ -1058,12 +1692,12 @@ class ROMParser:
             print(f"Error: {system_name} Cover art image [width:{cover_width} height: {cover_height}] will overflow!")
             exit(-1)        
 
-        with open(file, "w", encoding = args.codepage) as f:
+        # Composed in memory, so an unchanged file isn't rewritten and
+        # doesn't make the firmware rebuild
+        with io.StringIO() as f:
             f.write(SYSTEM_PROTO_TEMPLATE.format(name=variable_name))
 
-            for i, rom in enumerate(roms):
-                if not (rom.publish):
-                    continue
+            for i, rom in published:
                 if folder == "gb":
                     save_size = self.get_gameboy_save_size(rom.path)
                 elif folder == "nes" and args.nofrendo == 0:
@@ -1072,15 +1706,9 @@ class ROMParser:
                 # Aligned
                 aligned_size = 4 * 1024
                 if rom.enable_save:
-                    rom_save_size = (
-                        (save_size + aligned_size - 1) // (aligned_size)
-                    ) * aligned_size
-                    total_save_size += rom_save_size
-                    if system_save_size < rom_save_size:
-                        system_save_size = rom_save_size
-                total_rom_size += rom.size
-                if (args.coverflow != 0) :
-                    total_img_size += rom.img_size
+                    rom_save_sizes.append(
+                        ((save_size + aligned_size - 1) // (aligned_size)) * aligned_size
+                    )
 
                 f.write(self.generate_object_file((rom),system_name))
                 if (args.coverflow != 0) :
@@ -1091,8 +1719,9 @@ class ROMParser:
                 if rom.enable_save:
                     f.write(self.generate_save_entry(save_prefix + str(i), save_size))
 
-                cheat_codes_and_descs = rom.get_cheat_codes();
+                # Systems without cheat support don't need the cheat files read
                 if cheat_codes_prefix:
+                    cheat_codes_and_descs = rom.get_cheat_codes()
                     f.write(self.generate_cheat_entry(cheat_codes_prefix, i, cheat_codes_and_descs))
 
             rom_entries = self.generate_rom_entries(
@@ -1111,20 +1740,27 @@ class ROMParser:
                     roms_count=pubcount,
                 )
             )
+            self.write_if_changed(file, f.getvalue(), encoding=args.codepage)
 
-        larger_rom_size = 0
-        for r in roms_uncompressed:
-            if r.ext in ["gg","sms","md","gen","bin"]:
-                if larger_rom_size < r.size: larger_rom_size = r.size
+        total_save_size = sum(rom_save_sizes)
+        system_save_size = max(rom_save_sizes, default=0)
+
+        larger_rom_size = max(
+            (r.size for r in roms_uncompressed if r.ext in ("gg","sms","md","gen","bin")),
+            default=0,
+        )
         return system_save_size, total_save_size, total_rom_size, total_img_size, current_id, larger_rom_size
 
-    def write_if_changed(self, path: str, data: str):
+    def write_if_changed(self, path: str, data: str, encoding: str = None):
         path = Path(path)
         old_data = None
         if path.exists():
-            old_data = path.read_text()
+            try:
+                old_data = path.read_text(encoding=encoding)
+            except UnicodeDecodeError:
+                pass  # written with another codepage, replace it
         if data != old_data:
-            path.write_text(data)
+            path.write_text(data, encoding=encoding)
 
     def parse(self, args):
         larger_save_size = 0
@@ -1135,54 +1771,15 @@ class ROMParser:
         build_config = ""
         current_id = 0
 
-        import json;
         script_path = Path(__file__).parent
         json_file = script_path / "roms" / "roms.json"
-        if Path(json_file).exists():
-            with open(json_file,'r') as load_f:
-                try:
-                    romdef = json.load(load_f)
-                    load_f.close()
-                except: 
-                    romdef = {}
-                    load_f.close()
+        if json_file.exists():
+            romdef = load_json(json_file)
         else :
             romdef = {}
 
-        romdef.setdefault('gb', {})
-        romdef.setdefault('nes', {})
-        romdef.setdefault('nes_bios', {})
-        romdef.setdefault('sms', {})
-        romdef.setdefault('gg', {})
-        romdef.setdefault('col', {})
-        romdef.setdefault('sg', {})
-        romdef.setdefault('pce', {})
-        romdef.setdefault('gw', {})
-        romdef.setdefault('md', {})
-        romdef.setdefault('msx', {})
-        romdef.setdefault('msx_bios', {})
-        romdef.setdefault('wsv', {})
-        romdef.setdefault('a7800', {})
-        romdef.setdefault('amstrad', {})
-
-        system_save_size, save_size, rom_size, img_size, current_id, larger_rom_size = self.generate_system(
-            "Core/Src/retro-go/gb_roms.c",
-            "Nintendo Gameboy",
-            "gb_system",
-            "gb",
-            ["gb", "gbc"],
-            "SAVE_GB_",
-            romdef["gb"],
-            None,
-            current_id,
-            args.compress,
-            args.compress_gb_speed,
-        )
-        total_save_size += save_size
-        total_rom_size += rom_size
-        total_img_size += img_size
-        build_config += "#define ENABLE_EMULATOR_GB\n" if rom_size > 0 else ""
-        if system_save_size > larger_save_size : larger_save_size = system_save_size
+        # A new dict per system, generate_system adds its defaults to them
+        romdef = {**{spec.folder: {} for spec in SYSTEMS}, **romdef}
 
         # Delete NES bios/mappers.h file to recreate it
         mappers_file = "build/mappers.h"
@@ -1192,279 +1789,91 @@ class ROMParser:
         mappers = open(mappers_file, 'w')
         mappers.close
 
-        system_save_size, save_size, rom_size, img_size, current_id, larger_rom_size = self.generate_system(
-            "Core/Src/retro-go/nes_roms.c",
-            "Nintendo Entertainment System",
-            "nes_system",
-            "nes",
-            ["nes","fds","nsf"],
-            "SAVE_NES_",
-            romdef["nes"],
-            "GG_NES_",
-            current_id,
-            args.compress,
-        )
-        total_save_size += save_size
-        total_rom_size += rom_size
-        total_img_size += img_size
-        build_config += "#define ENABLE_EMULATOR_NES\n" if rom_size > 0 else ""
-        if system_save_size > larger_save_size : larger_save_size = system_save_size
-
-        # NES FDS bios (only parse if there are some NES games)
-        if rom_size > 0:
-            system_save_size, save_size, rom_size, img_size, current_id, larger_rom_size = self.generate_system(
-                "Core/Src/retro-go/nes_bios.c",
-                "NES_BIOS",
-                "nes_bios",
-                "nes_bios",
-                ["rom","nes"],
-                "SAVE_NESB_",
-                romdef["nes_bios"],
-                None,
-                current_id
-            )
-            total_save_size += save_size
-            total_rom_size += rom_size
-            total_img_size += img_size
-        else:
-            system_save_size, save_size, rom_size, img_size, current_id, larger_rom_size = self.generate_system(
-                "Core/Src/retro-go/nes_bios.c",
-                "NES_BIOS",
-                "nes_bios",
-                "nes_bios",
-                ["fakeToGenerateEmtyC"],
-                "SAVE_NESB_",
-                romdef["nes_bios"],
-                None,
-                current_id
-            )
+        _load_file_cache(INCOMPRESSIBLE_CACHE_FILE)  # load once before the threads share it
+
+        # Finding, converting and compressing the roms of a system doesn't
+        # depend on the other systems, so do it for all of them at once.
+        # Rom ids and .c files are still generated below in declaration order.
+        # The bios systems depend on the roms found, they are prepared there.
+        # Their prints are held back and shown as each system is generated.
+        with redirect_stdout(_ThreadOutput(sys.stdout)) as output, \
+                ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            prepared = {
+                spec.folder: executor.submit(
+                    output.capture,
+                    self.prepare_system,
+                    spec.system_name,
+                    spec.variable_name,
+                    spec.folder,
+                    spec.extensions,
+                    romdef[spec.folder],
+                    args.compress if spec.compress else None,
+                    spec.compress_gb_speed and args.compress_gb_speed,
+                )
+                for spec in SYSTEMS
+                if spec.bios_for is None
+            }
 
-        system_save_size, save_size, rom_size, img_size, current_id, larger_rom_size = self.generate_system(
-            "Core/Src/retro-go/sms_roms.c",
-            "Sega Master System",
-            "sms_system",
-            "sms",
-            ["sms"],
-            "SAVE_SMS_",
-            romdef["sms"],
-            None,
-            current_id,
-        )
-        if sega_larger_rom_size < larger_rom_size : sega_larger_rom_size = larger_rom_size
-
-        total_save_size += save_size
-        total_rom_size += rom_size
-        total_img_size += img_size
-        build_config += "#define ENABLE_EMULATOR_SMS\n" if rom_size > 0 else ""
-        if system_save_size > larger_save_size : larger_save_size = system_save_size
-
-        system_save_size, save_size, rom_size, img_size, current_id, larger_rom_size = self.generate_system(
-            "Core/Src/retro-go/gg_roms.c",
-            "Sega Game Gear",
-            "gg_system",
-            "gg",
-            ["gg"],
-            "SAVE_GG_",
-            romdef["gg"],
-            None,
-            current_id,
-        )
-        if sega_larger_rom_size < larger_rom_size : sega_larger_rom_size = larger_rom_size
-        total_save_size += save_size
-        total_rom_size += rom_size
-        total_img_size += img_size
-        build_config += "#define ENABLE_EMULATOR_GG\n" if rom_size > 0 else ""
-        if system_save_size > larger_save_size : larger_save_size = system_save_size
-
-        system_save_size, save_size, rom_size, img_size, current_id, larger_rom_size = self.generate_system(
-            "Core/Src/retro-go/md_roms.c",
-            "Sega Genesis",
-            "md_system",
-            "md",
-            ["md","gen","bin"],
-            "SAVE_MD_",
-            romdef["md"],
-            None,
-            current_id,
-        )
-        if sega_larger_rom_size < larger_rom_size : sega_larger_rom_size = larger_rom_size
-        total_save_size += save_size
-        total_rom_size += rom_size
-        total_img_size += img_size
-        build_config += "#define ENABLE_EMULATOR_MD\n" if rom_size > 0 else ""
-        if system_save_size > larger_save_size : larger_save_size = system_save_size
-
-        system_save_size, save_size, rom_size, img_size, current_id, larger_rom_size = self.generate_system(
-            "Core/Src/retro-go/col_roms.c",
-            "Colecovision",
-            "col_system",
-            "col",
-            ["col"],
-            "SAVE_COL_",
-            romdef["col"],
-            None,
-            current_id,
-        )
-        total_save_size += save_size
-        total_rom_size += rom_size
-        total_img_size += img_size
-        build_config += "#define ENABLE_EMULATOR_COL\n" if rom_size > 0 else ""
-        if system_save_size > larger_save_size : larger_save_size = system_save_size
-
-        system_save_size, save_size, rom_size, img_size, current_id, larger_rom_size = self.generate_system(
-            "Core/Src/retro-go/sg1000_roms.c",
-            "Sega SG-1000",
-            "sg1000_system",
-            "sg",
-            ["sg"],
-            "SAVE_SG1000_",
-            romdef["sg"],
-            None,
-            current_id,
-        )
-        total_save_size += save_size
-        total_rom_size += rom_size
-        total_img_size += img_size
-        build_config += "#define ENABLE_EMULATOR_SG1000\n" if rom_size > 0 else ""
-        if system_save_size > larger_save_size : larger_save_size = system_save_size
-
-        system_save_size, save_size, rom_size, img_size, current_id, larger_rom_size = self.generate_system(
-            "Core/Src/retro-go/pce_roms.c",
-            "PC Engine",
-            "pce_system",
-            "pce",
-            ["pce"],
-            "SAVE_PCE_",
-            romdef["pce"],
-            "GG_PCE_",
-            current_id,
-            args.compress,
-        )
+            # Fail fast (exit(-1) included), without waiting for the systems
+            # still preparing, wherever the error comes from
+            failed = []
 
-        total_save_size += save_size
-        total_rom_size += rom_size
-        total_img_size += img_size
-        build_config += "#define ENABLE_EMULATOR_PCE\n" if rom_size > 0 else ""
-        if system_save_size > larger_save_size : larger_save_size = system_save_size
-
-        system_save_size, save_size, rom_size, img_size, current_id, larger_rom_size = self.generate_system(
-            "Core/Src/retro-go/gw_roms.c",
-            "Game & Watch",
-            "gw_system",
-            "gw",
-            ["gw"],
-            "SAVE_GW_",
-            romdef["gw"],
-            None,
-            current_id,
-        )
-        total_save_size += save_size
-        total_rom_size += rom_size
-        total_img_size += img_size
-        build_config += "#define ENABLE_EMULATOR_GW\n" if rom_size > 0 else ""
-        if system_save_size > larger_save_size : larger_save_size = system_save_size
-
-        system_save_size, save_size, rom_size, img_size, current_id, larger_rom_size = self.generate_system(
-            "Core/Src/retro-go/msx_roms.c",
-            "MSX",
-            "msx_system",
-            "msx",
-            ["rom","mx1","mx2","dsk"],
-            "SAVE_MSX_",
-            romdef["msx"],
-            "MCF_MSX_",
-            current_id,
-            args.compress
-        )
-        total_save_size += save_size
-        total_rom_size += rom_size
-        total_img_size += img_size
-        build_config += "#define ENABLE_EMULATOR_MSX\n" if rom_size > 0 else ""
-        if system_save_size > larger_save_size : larger_save_size = system_save_size
-
-        #MSX bios (only parse if there are some MSX games)
-        if rom_size > 0:
-            #Check that required bios files are here and patch files if needed
-            if parse_msx_bios_files():
-                system_save_size, save_size, rom_size, img_size, current_id, larger_rom_size = self.generate_system(
-                    "Core/Src/retro-go/msx_bios.c",
-                    "MSX_BIOS",
-                    "msx_bios",
-                    "msx_bios",
-                    ["rom"],
-                    "SAVE_MSXB_",
-                    romdef["msx_bios"],
-                    None,
-                    current_id
-                )
-                total_save_size += save_size
-                total_rom_size += rom_size
-                total_img_size += img_size
-            else:
-                exit(-1)
-        else:
-            system_save_size, save_size, rom_size, img_size, current_id, larger_rom_size = self.generate_system(
-                "Core/Src/retro-go/msx_bios.c",
-                "MSX_BIOS",
-                "msx_bios",
-                "msx_bios",
-                ["fakeToGenerateEmtyC"],
-                "SAVE_MSXB_",
-                romdef["msx_bios"],
-                None,
-                current_id
-            )
+            def cancel_on_error(future):
+                if not future.cancelled() and future.exception() is not None:
+                    failed.append(future)
+                    self._cancel_pending(executor)
 
-        system_save_size, save_size, rom_size, img_size, current_id, larger_rom_size = self.generate_system(
-            "Core/Src/retro-go/wsv_roms.c",
-            "Watara Supervision",
-            "wsv_system",
-            "wsv",
-            ["bin","sv"],
-            "SAVE_WSV_",
-            romdef["wsv"],
-            None,
-            current_id,
-            args.compress
-        )
-        total_save_size += save_size
-        total_rom_size += rom_size
-        build_config += "#define ENABLE_EMULATOR_WSV\n" if rom_size > 0 else ""
-        if system_save_size > larger_save_size : larger_save_size = system_save_size
-
-        system_save_size, save_size, rom_size, img_size, current_id, larger_rom_size = self.generate_system(
-            "Core/Src/retro-go/a7800_roms.c",
-            "Atari 7800",
-            "a7800_system",
-            "a7800",
-            ["a78","bin"],
-            "SAVE_A7800_",
-            romdef["a7800"],
-            None,
-            current_id,
-            args.compress
-        )
-        total_save_size += save_size
-        total_rom_size += rom_size
-        build_config += "#define ENABLE_EMULATOR_A7800\n" if rom_size > 0 else ""
-        if system_save_size > larger_save_size : larger_save_size = system_save_size
-
-        system_save_size, save_size, rom_size, img_size, current_id, larger_rom_size = self.generate_system(
-            "Core/Src/retro-go/amstrad_roms.c",
-            "Amstrad CPC",
-            "amstrad_system",
-            "amstrad",
-            ["dsk"],
-            "SAVE_AMSTRAD_",
-            romdef["amstrad"],
-            None,
-            current_id,
-            args.compress
-        )
-        total_save_size += save_size
-        total_rom_size += rom_size
-        build_config += "#define ENABLE_EMULATOR_AMSTRAD\n" if rom_size > 0 else ""
-        if system_save_size > larger_save_size : larger_save_size = system_save_size
+            for future in prepared.values():
+                future.add_done_callback(cancel_on_error)
+
+            try:
+                rom_sizes = {}
+                for spec in SYSTEMS:
+                    if spec.bios_for is not None:
+                        if rom_sizes[spec.bios_for] == 0:
+                            spec = replace(spec, extensions=["fakeToGenerateEmtyC"])
+                        elif spec.check is not None and not spec.check():
+                            exit(-1)
+
+                    prepared_system = None
+                    if spec.folder in prepared:
+                        prepared_system, printed = prepared[spec.folder].result()
+                        # Above the progress bars of the systems still running
+                        (tqdm.write if tqdm else print)(printed, end="")
+
+                    system_save_size, save_size, rom_size, img_size, current_id, larger_rom_size = self.generate_system(
+                        spec.file,
+                        spec.system_name,
+                        spec.variable_name,
+                        spec.folder,
+                        spec.extensions,
+                        spec.save_prefix,
+                        romdef[spec.folder],
+                        spec.cheat_codes_prefix,
+                        current_id,
+                        prepared=prepared_system,
+                    )
+                    rom_sizes[spec.folder] = rom_size
+
+                    total_save_size += save_size
+                    total_rom_size += rom_size
+                    total_img_size += img_size
+                    if spec.define:
+                        build_config += f"#define {spec.define}\n" if rom_size > 0 else ""
+                    if system_save_size > larger_save_size : larger_save_size = system_save_size
+                    if spec.rom_cache and sega_larger_rom_size < larger_rom_size : sega_larger_rom_size = larger_rom_size
+            except BaseException:
+                self._cancel_pending(executor)
+                if failed:
+                    # Not what a system got from being cancelled
+                    raise failed[0].exception() from None
+                raise
+
+        if self._compress_executor is not None:
+            self._compress_executor.shutdown()
+        prune_compress_cache()
+
+        self.write_archive()
 
         total_size = total_save_size + total_rom_size + total_img_size
         #total_size +=sega_larger_rom_size
@@ -1552,6 +1961,24 @@ if __name__ == "__main__":
         default=None,
         help="Compression method. Defaults to no compression.",
     )
+    parser.add_argument(
+        "--compress_level",
+        type=int,
+        choices=range(10),
+        default=None,
+        help="Compression level, the LZMA preset (0-9). Defaults to 6; lower "
+        "levels compress faster with a larger result, higher ones rarely "
+        "gain much with the 16 KiB dictionary.",
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Number of worker processes used for compression, spread over "
+        "roms or, when there are fewer roms than workers, over their banks. "
+        "Defaults to the number of CPUs.",
+    )
     parser.add_argument(
         "--compress_gb_speed",
         dest="compress_gb_speed",
@@ -1579,6 +2006,11 @@ if __name__ == "__main__":
     
     if args.compress and "." + args.compress not in COMPRESSIONS:
         raise ValueError(f"Unknown compression method specified: {args.compress}")
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+
+    if args.coverflow != 0:
+        suggest_pillow_simd()
 
     roms_path = Path("build/roms")
     roms_path.mkdir(mode=0o755, parents=True, exist_ok=True)